@@ -0,0 +1,3 @@
+from .core import extract_main_content, fetch_webpage_content_impl, search_perplexity_impl
+
+__all__ = ["extract_main_content", "fetch_webpage_content_impl", "search_perplexity_impl"]
@@ -0,0 +1,519 @@
+"""
+Shared search, fetch and extraction logic for the Perplexity MCP servers.
+The server entrypoints only register these as MCP tools.
+"""
+import os
+import asyncio
+import contextlib
+import hashlib
+import threading
+import httpx
+from urllib.parse import urldefrag, urlparse
+import orjson
+from cachetools import LRUCache, TTLCache
+import redis.asyncio as redis
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from redis.asyncio.retry import Retry as RedisRetry
+from redis.backoff import NoBackoff
+from redis.exceptions import RedisError
+from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Perplexity API key
+PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
+
+# Shared session so keep-alive connections are reused across
+# fetch_webpage_content calls
+SESSION = requests.Session()
+SESSION.headers.update({
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+    "Accept-Encoding": "gzip, br"
+})
+_adapter = HTTPAdapter(
+    pool_connections=50,
+    pool_maxsize=100,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+# Connection pool size of HTTP_CLIENT, and how much of it page fetches may use;
+# the remainder stays free so Perplexity API calls never wait on the pool
+MAX_CONNECTIONS = 50
+MAX_CONCURRENT_FETCHES = MAX_CONNECTIONS - 10
+
+# Shared async client for the Perplexity API and search result pages.
+# HTTP/2 multiplexes requests to the same host over one connection.
+HTTP_CLIENT = httpx.AsyncClient(
+    http2=True,
+    follow_redirects=True,
+    headers={
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+        "Accept-Encoding": "gzip, br"
+    },
+    limits=httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_CONNECTIONS,
+        keepalive_expiry=30.0
+    ),
+    timeout=httpx.Timeout(connect=3.0, read=10.0, write=10.0, pool=5.0)
+)
+
+# Bound page fetches in flight overall and per host, so a single
+# domain (e.g. with search_domain_filter) isn't hit 20 times at once
+FETCH_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+MAX_FETCHES_PER_HOST = 4
+# host -> [semaphore, tasks using or waiting on it]; entries are dropped
+# once idle so the dict only holds hosts with fetches in flight
+HOST_SEMAPHORES: dict = {}
+
+@contextlib.asynccontextmanager
+async def host_slot(host: str):
+    """
+    Hold one of the MAX_FETCHES_PER_HOST fetch slots for host.
+    """
+    entry = HOST_SEMAPHORES.get(host)
+    if entry is None:
+        entry = HOST_SEMAPHORES[host] = [asyncio.Semaphore(MAX_FETCHES_PER_HOST), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del HOST_SEMAPHORES[host]
+
+# Optional Redis cache for search responses and extracted page content
+REDIS_URL = os.getenv("REDIS_URL")
+# Tight timeouts and no retries: an unreachable Redis must fail fast
+# so every lookup falls through to a normal fetch instead of stalling
+REDIS_TIMEOUT = float(os.getenv("PX_REDIS_TIMEOUT", "0.5"))
+REDIS = redis.Redis.from_url(
+    REDIS_URL,
+    decode_responses=False,
+    socket_connect_timeout=REDIS_TIMEOUT,
+    socket_timeout=REDIS_TIMEOUT,
+    retry=RedisRetry(NoBackoff(), 0)
+) if REDIS_URL else None
+SEARCH_CACHE_TTL = int(os.getenv("PX_TTL", "600"))
+PAGE_CACHE_TTL = int(os.getenv("PX_PAGE_TTL", "86400"))
+
+# Recently failed URLs, so repeat searches skip them instead of waiting again
+FAILED_URLS = TTLCache(maxsize=10_000, ttl=int(os.getenv("PX_FAILED_TTL", "300")))
+
+def is_persistent_failure(error: Exception) -> bool:
+    """
+    Return True for fetch failures worth remembering: 4xx responses
+    (other than 429) and connection errors. Timeouts and 5xx are retried.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return 400 <= status_code < 500 and status_code != 429
+    return isinstance(error, httpx.ConnectError)
+
+async def cache_get(key: str):
+    """
+    Return the cached value for key, or None on a miss or when Redis is unavailable.
+    """
+    if REDIS is None:
+        return None
+    try:
+        cached = await REDIS.get(key)
+    except RedisError:
+        return None
+    return orjson.loads(cached) if cached else None
+
+async def cache_set(key: str, ttl: int, value) -> None:
+    """
+    Store value under key for ttl seconds, ignoring Redis failures.
+    """
+    if REDIS is None:
+        return
+    try:
+        await REDIS.setex(key, ttl, orjson.dumps(value))
+    except RedisError:
+        pass
+
+# Common selectors for main content areas
+_SELECTORS = (
+    'main', 'article', '[role="main"]',
+    '.content', '#content', '.main-content', '#main-content',
+    '.post-content', '.entry-content', '.article-content',
+    '.page-content', '#page-content', '.post-body', '.article-body',
+    '.content-area', '.site-content', '#site-content',
+    '.blog-post', '.single-post', '.post', '#post',
+    '[itemprop="articleBody"]', '.markdown-body'
+)
+# Single selector so the document is walked once instead of per selector
+_COMBINED = ", ".join(_SELECTORS)
+
+# Non-content elements stripped before extracting text
+_JUNK_TAGS = ('script', 'style', 'nav', 'header', 'footer', 'aside', 'iframe')
+
+# Upper bound on HTML downloaded and parsed per page
+MAX_HTML_BYTES = 512 * 1024
+
+# Hosts and file types that yield little text after extraction (SPAs,
+# login walls, media); search results pointing at them aren't fetched
+_BLOCK_HOSTS = frozenset({
+    "twitter.com", "x.com", "facebook.com", "instagram.com",
+    "linkedin.com", "youtube.com", "youtu.be"
+})
+_BLOCK_EXTS = (".pdf", ".zip", ".mp4", ".mp3", ".png", ".jpg", ".jpeg", ".gif", ".webp")
+
+def is_blocked(url: str) -> bool:
+    """
+    Return True if a result URL is on a blocked host (or any subdomain
+    of one) or points at a blocked file type.
+    """
+    parsed = urlparse(url)
+    parts = (parsed.hostname or "").split(".")
+    if any(".".join(parts[i:]) in _BLOCK_HOSTS for i in range(len(parts) - 1)):
+        return True
+    return parsed.path.lower().endswith(_BLOCK_EXTS)
+
+# Content types worth parsing; anything else is skipped
+_HTML_TYPES = ("text/html", "application/xhtml")
+
+def is_html(content_type: str) -> bool:
+    """
+    Return True if a Content-Type header looks like HTML (or is missing).
+    """
+    return not content_type or content_type.lower().startswith(_HTML_TYPES)
+
+def charset_from_content_type(content_type: str) -> str:
+    """
+    Return the charset parameter of a Content-Type header, or None.
+    No ISO-8859-1 default is assumed for text/* (unlike requests), so
+    both tools fall back to utf-8 the same way.
+    """
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset":
+            return value.strip().strip("'\"") or None
+    return None
+
+def decode_html(body: bytes, encoding: str = None) -> str:
+    """
+    Decode a (possibly truncated) HTML body, replacing undecodable bytes.
+    """
+    try:
+        return body.decode(encoding or "utf-8", errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+async def read_html(response: httpx.Response) -> str:
+    """
+    Read at most MAX_HTML_BYTES from a streamed httpx response.
+    """
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        body += chunk
+        if len(body) >= MAX_HTML_BYTES:
+            break
+    charset = charset_from_content_type(response.headers.get("Content-Type", ""))
+    return decode_html(bytes(body[:MAX_HTML_BYTES]), charset)
+
+# HTML backend: "lexbor" (selectolax, default) or "bs4" (BeautifulSoup + lxml)
+HTML_PARSER = os.getenv("HTML_PARSER", "lexbor")
+
+def _collect_text(strings, limit: int) -> str:
+    """
+    Join whitespace-collapsed text pieces, stopping once `limit`
+    characters have been gathered instead of walking the whole tree.
+    """
+    parts = []
+    length = 0
+    for piece in strings:
+        piece = ' '.join(piece.split())
+        if piece:
+            parts.append(piece)
+            length += len(piece) + 1
+            if length > limit:
+                break
+    return ' '.join(parts)[:limit]
+
+def _lexbor_strings(node):
+    for child in node.traverse(include_text=True):
+        if child.tag == '-text':
+            yield child.text_content
+
+def _extract_lexbor(html: str, limit: int) -> str:
+    tree = LexborHTMLParser(html)
+    
+    # Remove script, style, and other non-content elements
+    for tag in _JUNK_TAGS:
+        for node in tree.css(tag):
+            node.decompose()
+    
+    # Try to find main content areas with common selectors
+    main_content = None
+    content_area = tree.css_first(_COMBINED)
+    if content_area is not None:
+        main_content = _collect_text(_lexbor_strings(content_area), limit)
+    
+    # Fallback to body content if no main area found
+    if not main_content:
+        root = tree.body or tree.root
+        main_content = _collect_text(_lexbor_strings(root), limit) if root is not None else ''
+    
+    return main_content
+
+def _extract_bs4(html: str, limit: int) -> str:
+    soup = BeautifulSoup(html, 'lxml')
+    
+    # Remove script, style, and other non-content elements
+    for element in soup(_JUNK_TAGS):
+        element.decompose()
+    
+    # Try to find main content areas with common selectors
+    main_content = None
+    hits = soup.select(_COMBINED, limit=1)
+    if hits:
+        main_content = _collect_text(hits[0].stripped_strings, limit)
+    
+    # Fallback to body content if no main area found
+    if not main_content:
+        main_content = _collect_text(soup.stripped_strings, limit)
+    
+    return main_content
+
+def extract_main_content(html: str, limit: int) -> str:
+    """
+    Extract up to `limit` characters of main readable text from an HTML
+    document, with whitespace collapsed. Text beyond the limit is never
+    materialized. Pure CPU work, safe to run in a worker thread.
+    """
+    if HTML_PARSER == "bs4":
+        return _extract_bs4(html, limit)
+    return _extract_lexbor(html, limit)
+
+# Extracted text for recently seen HTML bodies, keyed by content hash.
+# Guarded by a lock since extraction runs in worker threads.
+_EXTRACT_CACHE = LRUCache(maxsize=1024)
+_EXTRACT_CACHE_LOCK = threading.Lock()
+
+def extract_main_content_cached(html: str, limit: int) -> str:
+    """
+    Memoized extract_main_content, so byte-identical pages served from
+    different URLs (mirrors, mobile/desktop) are only parsed once.
+    """
+    key = (hashlib.blake2b(html.encode(), digest_size=16).digest(), limit)
+    with _EXTRACT_CACHE_LOCK:
+        cached = _EXTRACT_CACHE.get(key)
+    if cached is not None:
+        return cached
+    
+    extracted = extract_main_content(html, limit)
+    with _EXTRACT_CACHE_LOCK:
+        _EXTRACT_CACHE[key] = extracted
+    return extracted
+
+async def fetch_and_extract(url: str) -> tuple:
+    """
+    Fetch a single result URL and extract its main content.
+    Returns a (content, content_extraction_status) pair.
+    """
+    cached_error = FAILED_URLS.get(url)
+    if cached_error is not None:
+        return None, f"error (cached): {cached_error}"
+    
+    page_key = "url:" + hashlib.sha256(url.encode()).hexdigest()
+    cached_content = await cache_get(page_key)
+    if cached_content is not None:
+        return cached_content, "success"
+    
+    try:
+        host = urlparse(url).netloc.lower()
+        async with host_slot(host), FETCH_SEMAPHORE:
+            async with HTTP_CLIENT.stream("GET", url) as page_response:
+                page_response.raise_for_status()
+                if not is_html(page_response.headers.get("Content-Type", "")):
+                    return None, "skipped: non-html"
+                html = await read_html(page_response)
+        
+        # Parse off the event loop so other fetches keep progressing
+        content = await asyncio.to_thread(extract_main_content_cached, html, 2000)
+        await cache_set(page_key, PAGE_CACHE_TTL, content)
+        return content, "success"
+    except Exception as fetch_error:
+        if is_persistent_failure(fetch_error):
+            FAILED_URLS[url] = str(fetch_error)
+        return None, f"error: {str(fetch_error)}"
+
+async def search_perplexity_impl(
+    query: str, 
+    max_results: int = 5, 
+    max_tokens_per_page: int = 1024,
+    country: str = None,
+    search_domain_filter: list = None
+) -> dict:
+    """
+    Search using Perplexity Search API with web search capability.
+    Returns ranked search results with URLs, titles, snippets, and extracted content.
+    
+    Args:
+        query: Search query string
+        max_results: Number of results (1-20, default 5)
+        max_tokens_per_page: Content extraction limit per page (default 1024)
+        country: ISO 3166-1 alpha-2 country code (e.g., "US", "GB")
+        search_domain_filter: List of domains to filter results (max 20)
+    """
+    cache_key = "px:" + hashlib.sha256(orjson.dumps({
+        "q": query,
+        "n": max_results,
+        "t": max_tokens_per_page,
+        "c": country,
+        "d": search_domain_filter
+    }, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    cached = await cache_get(cache_key)
+    if cached is not None:
+        return cached
+    
+    try:
+        headers = {
+            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        
+        payload = {
+            "query": query,
+            "max_results": min(max(max_results, 1), 20),
+            "max_tokens_per_page": max_tokens_per_page
+        }
+        
+        if country:
+            payload["country"] = country
+        if search_domain_filter:
+            payload["search_domain_filter"] = search_domain_filter[:20]
+        
+        response = await HTTP_CLIENT.post("https://api.perplexity.ai/search", headers=headers, json=payload)
+        response.raise_for_status()
+        
+        data = orjson.loads(response.content)
+        if not isinstance(data, dict):
+            raise ValueError(f"Unexpected Perplexity API response: {type(data).__name__}")
+        results = data.get("results", [])
+        
+        enhanced_results = [
+            {
+                "title": result.get("title"),
+                "url": result.get("url"),
+                "snippet": result.get("snippet"),
+                "date": result.get("date"),
+                "content": None,
+                "content_extraction_status": "not_attempted"
+            }
+            for result in results
+        ]
+        
+        # Normalize each URL once; fragments are never sent to the server
+        # so they don't make a page distinct. A malformed URL only fails
+        # its own entry.
+        page_urls = []
+        blocked = set()
+        for enhanced_result in enhanced_results:
+            page_url = None
+            if enhanced_result["url"]:
+                try:
+                    page_url = urldefrag(enhanced_result["url"]).url
+                    if is_blocked(page_url):
+                        blocked.add(page_url)
+                except ValueError as e:
+                    page_url = None
+                    enhanced_result["content_extraction_status"] = f"error: {str(e)}"
+            page_urls.append(page_url)
+        
+        # Fetch each distinct URL once, concurrently. Blocked URLs map to
+        # None and are never fetched. gather() cancels every pending fetch
+        # if the tool call itself is cancelled.
+        pages = dict.fromkeys(page_url for page_url in page_urls if page_url)
+        fetch_urls = [page_url for page_url in pages if page_url not in blocked]
+        outcomes = await asyncio.gather(*(fetch_and_extract(page_url) for page_url in fetch_urls))
+        pages.update(zip(fetch_urls, outcomes))
+        
+        # Duplicate URLs share the same extracted content
+        for enhanced_result, page_url in zip(enhanced_results, page_urls):
+            if page_url is None:
+                continue
+            outcome = pages[page_url]
+            if outcome is None:
+                # Fall back to the API snippet so callers still get some text
+                enhanced_result["content"] = enhanced_result["snippet"]
+                enhanced_result["content_extraction_status"] = "skipped: blocked"
+                continue
+            content, status = outcome
+            enhanced_result["content"] = content
+            enhanced_result["content_extraction_status"] = status
+        
+        result = {
+            "status": "success",
+            "query": query,
+            "results": enhanced_results,
+            "total_results": len(enhanced_results)
+        }
+        # Don't freeze fresh fetch errors (timeouts, 5xx, parse failures)
+        # into the search cache; they are meant to be retried next time.
+        # Persistent ones come back as "error (cached)" and are fine to keep.
+        if not any(r["content_extraction_status"].startswith("error: ") for r in enhanced_results):
+            await cache_set(cache_key, SEARCH_CACHE_TTL, result)
+        return result
+    
+    # ValueError covers non-JSON bodies (orjson.JSONDecodeError) too
+    except (httpx.HTTPError, ValueError) as e:
+        return {
+            "status": "error",
+            "query": query,
+            "error": str(e)
+        }
+
+def fetch_webpage_content_impl(url: str) -> dict:
+    """
+    Fetch and extract content from a webpage.
+    Returns the main content (first 5000 chars) and metadata.
+    content_length is the size of the downloaded HTML (capped at 512 KB),
+    since text past the first 5000 chars is no longer extracted.
+    """
+    try:
+        with SESSION.get(url, timeout=10, stream=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "")
+            if not is_html(content_type):
+                return {
+                    "status": "error",
+                    "url": url,
+                    "error": f"skipped: non-html content ({content_type})",
+                    "status_code": response.status_code
+                }
+            
+            # Read at most MAX_HTML_BYTES instead of the whole body
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=65536):
+                body += chunk
+                if len(body) >= MAX_HTML_BYTES:
+                    break
+            html = decode_html(bytes(body[:MAX_HTML_BYTES]), charset_from_content_type(content_type))
+        
+        # Extract main text content with the configured HTML backend
+        content = extract_main_content_cached(html, 5000)
+        
+        return {
+            "status": "success",
+            "url": url,
+            "content": content,
+            "content_length": len(html),
+            "status_code": response.status_code
+        }
+    
+    except requests.exceptions.RequestException as e:
+        return {
+            "status": "error",
+            "url": url,
+            "error": str(e)
+        }